@@ -22,16 +22,23 @@ Usage:
 
 from __future__ import annotations
 
+import io
 import os
+import re
 import sys
+import time
+import random
 import logging
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Optional, List, Tuple
+from typing import Dict, Optional, List, Tuple
 
 # Google Drive API
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from googleapiclient.http import build_http, MediaFileUpload, MediaInMemoryUpload, MediaUpload
 from googleapiclient.errors import HttpError
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
@@ -54,8 +61,42 @@ LOCAL_ROOT = Path('.').resolve()
 
 LOG_LEVEL = os.environ.get("IMG_PUBLISHER_LOG_LEVEL", "INFO").upper()
 
+# Number of concurrent Drive uploads (Drive allows roughly 10 writes/s per user)
+_upload_workers = os.environ.get("IMG_PUBLISHER_UPLOAD_WORKERS", "4")
+UPLOAD_WORKERS = max(1, int(_upload_workers)) if _upload_workers.strip().isdigit() else 4
+
+# Files smaller than this are sent in a single multipart request instead of a resumable session
+RESUMABLE_THRESHOLD = 5 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 16 * 1024 * 1024  # fewer, larger writes per resumable upload
+
+# Upload retries with exponential backoff for rate limiting and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_EXCEPTIONS = (TimeoutError, ConnectionError)  # transient transport errors
+MAX_UPLOAD_RETRIES = 6
+MAX_RETRY_DELAY = 60
+
+# Socket timeout (seconds) for Drive HTTP connections
+HTTP_TIMEOUT = 120
+
 # --------------------------------------------------------------------
 
+# Line pattern for wrap_text; re caches the compiled form per max_chars
+WRAP_PATTERN_TEMPLATE = r".{%d,}?[/?=&\-_.]|.+"
+
+# Drive query used by drive_find_folder
+FOLDER_QUERY_TEMPLATE = (
+    "name = '{name}' and "
+    "mimeType = 'application/vnd.google-apps.folder' and "
+    "'{parent_id}' in parents and trashed = false"
+)
+
+# googleapiclient service objects are not thread-safe; keep one per thread
+_thread_local = threading.local()
+
+# Known Drive folder IDs keyed by (parent_id, name), shared by all threads
+_folder_cache: Dict[Tuple[str, str], str] = {}
+_folder_cache_lock = threading.Lock()
+
 
 def setup_logging() -> None:
     logging.basicConfig(
@@ -64,9 +105,9 @@ def setup_logging() -> None:
     )
 
 
-def get_drive_service() -> any:
+def get_drive_credentials() -> Credentials:
     """
-    Build and return an authenticated Drive API service.
+    Load (or obtain via OAuth flow) and return valid Drive credentials.
     """
     creds = None
     if Path(TOKEN_FILE).exists():
@@ -89,21 +130,39 @@ def get_drive_service() -> any:
         with open(TOKEN_FILE, 'w') as token:
             token.write(creds.to_json())
 
-    service = build('drive', 'v3', credentials=creds)
+    return creds
+
+
+def get_drive_service(creds: Credentials) -> any:
+    """
+    Return an authenticated Drive API service for the calling thread.
+    Each thread keeps its own persistent (keep-alive) HTTP connection.
+    """
+    service = getattr(_thread_local, 'service', None)
+    if service is None:
+        # build_http() keeps 308 (Resume Incomplete) out of the redirect codes,
+        # which resumable uploads rely on
+        transport = build_http()
+        transport.timeout = HTTP_TIMEOUT
+        http = AuthorizedHttp(creds, http=transport)
+        service = build('drive', 'v3', http=http, cache_discovery=False)
+        _thread_local.service = service
     return service
 
 
 def drive_find_folder(service, name: str, parent_id: str) -> Optional[str]:
     """
     Return the folder ID if a folder with `name` exists under `parent_id`, else None.
+    Found IDs are cached for the rest of the run.
     """
+    with _folder_cache_lock:
+        folder_id = _folder_cache.get((parent_id, name))
+    if folder_id:
+        return folder_id
+
     # Escape single quotes in folder name for Drive query
     safe_name = name.replace("'", "\\'")
-    query = (
-        f"name = '{safe_name}' and "
-        f"mimeType = 'application/vnd.google-apps.folder' and "
-        f"'{parent_id}' in parents and trashed = false"
-    )
+    query = FOLDER_QUERY_TEMPLATE.format(name=safe_name, parent_id=parent_id)
     results = service.files().list(
         q=query,
         spaces='drive',
@@ -112,6 +171,8 @@ def drive_find_folder(service, name: str, parent_id: str) -> Optional[str]:
     ).execute()
     files = results.get('files', [])
     if files:
+        with _folder_cache_lock:
+            _folder_cache[(parent_id, name)] = files[0]['id']
         return files[0]['id']
     return None
 
@@ -131,6 +192,8 @@ def drive_ensure_folder(service, name: str, parent_id: str) -> str:
     }
     folder = service.files().create(body=file_metadata, fields='id, name').execute()
     logging.info(f"Created Drive folder: {name} (id={folder['id']})")
+    with _folder_cache_lock:
+        _folder_cache[(parent_id, name)] = folder['id']
     return folder['id']
 
 
@@ -138,9 +201,27 @@ def drive_upload_file(service, local_path: Path, parent_id: str) -> str:
     """
     Upload a file to Drive under parent_id. Returns file ID.
     """
-    media = MediaFileUpload(local_path.as_posix(), resumable=True)
+    if local_path.stat().st_size < RESUMABLE_THRESHOLD:
+        media = MediaFileUpload(local_path.as_posix(), resumable=False)
+    else:
+        media = MediaFileUpload(local_path.as_posix(), chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+    return drive_upload_media(service, media, local_path.name, parent_id)
+
+
+def drive_upload_bytes(service, data: bytes, name: str, mimetype: str, parent_id: str) -> str:
+    """
+    Upload in-memory content to Drive under parent_id as `name`. Returns file ID.
+    """
+    media = MediaInMemoryUpload(data, mimetype=mimetype, resumable=False)
+    return drive_upload_media(service, media, name, parent_id)
+
+
+def drive_upload_media(service, media: MediaUpload, name: str, parent_id: str) -> str:
+    """
+    Create a file named `name` under parent_id with the given media body. Returns file ID.
+    """
     metadata = {
-        'name': local_path.name,
+        'name': name,
         'parents': [parent_id]
     }
     created = service.files().create(
@@ -148,31 +229,93 @@ def drive_upload_file(service, local_path: Path, parent_id: str) -> str:
         media_body=media,
         fields='id, name'
     ).execute()
-    logging.info(f"Uploaded: {local_path.name} (id={created['id']})")
+    logging.info(f"Uploaded: {name} (id={created['id']})")
     return created['id']
 
 
+def drive_upload_with_retry(name: str, upload, *args) -> str:
+    """
+    Call upload(*args) (drive_upload_file or drive_upload_bytes), retrying with
+    exponential backoff on 429/5xx responses and on timeouts or dropped connections.
+    Honors the Retry-After header when present.
+    """
+    for attempt in range(MAX_UPLOAD_RETRIES + 1):
+        delay = min(2 ** attempt + random.random(), MAX_RETRY_DELAY)
+        try:
+            return upload(*args)
+        except HttpError as e:
+            if e.resp.status not in RETRY_STATUSES or attempt == MAX_UPLOAD_RETRIES:
+                raise
+            retry_after = e.resp.get('retry-after')
+            if retry_after and retry_after.isdigit():
+                delay = min(int(retry_after), MAX_RETRY_DELAY)
+            reason = e.resp.status
+        except RETRY_EXCEPTIONS as e:
+            if attempt == MAX_UPLOAD_RETRIES:
+                raise
+            reason = repr(e)
+        logging.warning(
+            f"Drive upload of {name} failed with {reason}; "
+            f"retrying in {delay:.1f}s ({attempt + 1}/{MAX_UPLOAD_RETRIES})"
+        )
+        time.sleep(delay)
+
+
+def drive_upload_files(executor: ThreadPoolExecutor, creds: Credentials, paths: List[Path], parent_id: str) -> None:
+    """
+    Upload files to Drive under parent_id concurrently on `executor`.
+    Returns once every upload has finished; failures are logged per file.
+    """
+    def upload(path: Path) -> str:
+        return drive_upload_with_retry(path.name, drive_upload_file, get_drive_service(creds), path, parent_id)
+
+    futures = {executor.submit(upload, p): p for p in paths}
+    for future in as_completed(futures):
+        try:
+            future.result()
+        except Exception as e:
+            logging.error(f"Drive upload failed for {futures[future].name}: {e}")
+
+
 def drive_make_public_and_get_link(service, folder_id: str) -> str:
     """
     Make the folder link-visible to anyone with the link and return webViewLink.
+    Existing permissions and the link are fetched in a single batch request;
+    the 'anyone' reader permission is only created if it is missing.
     """
-    # Create (or add another) permission for 'anyone' reader.
-    service.permissions().create(
-        fileId=folder_id,
-        body={'type': 'anyone', 'role': 'reader', 'allowFileDiscovery': False},
-    ).execute()
+    responses = {}
 
+    def callback(request_id, response, exception):
+        if exception is not None:
+            raise exception
+        responses[request_id] = response
+
+    batch = service.new_batch_http_request(callback=callback)
+    batch.add(service.permissions().list(fileId=folder_id, fields='permissions(id, type, role)'),
+              request_id='permissions')
     # Get the webViewLink
-    meta = service.files().get(fileId=folder_id, fields='id, webViewLink').execute()
-    link = meta.get('webViewLink')
+    batch.add(service.files().get(fileId=folder_id, fields='id, webViewLink'), request_id='meta')
+    batch.execute()
+
+    is_public = any(
+        p.get('type') == 'anyone' and p.get('role') == 'reader'
+        for p in responses.get('permissions', {}).get('permissions', [])
+    )
+    if not is_public:
+        service.permissions().create(
+            fileId=folder_id,
+            body={'type': 'anyone', 'role': 'reader', 'allowFileDiscovery': False},
+        ).execute()
+
+    link = responses.get('meta', {}).get('webViewLink')
     if not link:
         raise RuntimeError("Failed to obtain webViewLink for folder.")
     return link
 
 
-def create_pdf(filepath: Path, link: str, folder_name: str) -> None:
+def create_pdf(link: str, folder_name: str) -> bytes:
     """
-    Create a simple PDF with the download instructions.
+    Create a simple PDF with the download instructions and return its content.
     Tries reportlab first; falls back to fpdf.
     """
     text = (
@@ -187,7 +330,8 @@ def create_pdf(filepath: Path, link: str, folder_name: str) -> None:
         from reportlab.pdfgen import canvas
         from reportlab.lib.units import inch
 
-        c = canvas.Canvas(filepath.as_posix(), pagesize=LETTER)
+        buf = io.BytesIO()
+        c = canvas.Canvas(buf, pagesize=LETTER)
         width, height = LETTER
         x_margin = 1 * inch
         y = height - 1.5 * inch
@@ -205,7 +349,7 @@ def create_pdf(filepath: Path, link: str, folder_name: str) -> None:
         c.drawText(text_obj)
         c.showPage()
         c.save()
-        return
+        return buf.getvalue()
     except Exception as e1:
         logging.debug(f"reportlab generation failed ({e1}); trying fpdf…")
 
@@ -222,8 +366,9 @@ def create_pdf(filepath: Path, link: str, folder_name: str) -> None:
         pdf.cell(0, 8, txt="Your files can be downloaded here:", ln=1)
         # MultiCell to wrap the long URL
         pdf.multi_cell(0, 8, txt=link)
-        pdf.output(filepath.as_posix())
-        return
+        out = pdf.output(dest='S')
+        # PyFPDF returns a latin-1 str, fpdf2 a bytearray
+        return out.encode('latin-1') if isinstance(out, str) else bytes(out)
     except Exception as e2:
         raise RuntimeError(
             "Failed to create PDF. Please install 'reportlab' or 'fpdf'."
@@ -233,17 +378,11 @@ def create_pdf(filepath: Path, link: str, folder_name: str) -> None:
 def wrap_text(s: str, max_chars: int) -> List[str]:
     """
     Simple hard wrap without breaking the URL structure too aggressively.
+    Each line is the shortest run of at least `max_chars` characters that ends
+    in one of "/?=&-_."; whatever remains forms the last line.
     """
-    lines = []
-    buf = ""
-    for ch in s:
-        buf += ch
-        if len(buf) >= max_chars and ch in "/?=&-_.":
-            lines.append(buf)
-            buf = ""
-    if buf:
-        lines.append(buf)
-    return lines
+    pattern = WRAP_PATTERN_TEMPLATE % max(max_chars - 1, 0)
+    return re.findall(pattern, s, flags=re.DOTALL)
 
 
 def scan_candidate_folders(root: Path) -> List[Tuple[Path, Path]]:
@@ -252,21 +391,24 @@ def scan_candidate_folders(root: Path) -> List[Tuple[Path, Path]]:
     under root that do not contain "download-instructions-*.pdf" files and have a 'scaled' subfolder.
     """
     candidates: List[Tuple[Path, Path]] = []
-    for entry in root.iterdir():
-        if entry.is_dir() and entry.name not in EXCLUDED_DIRS:
-            # Check if folder contains any download-instructions-*.pdf files
+    with os.scandir(root) as entries:
+        dirs = [e for e in entries if e.is_dir() and e.name not in EXCLUDED_DIRS]
+    for entry in dirs:
+        # Check if folder contains any download-instructions-*.pdf files
+        with os.scandir(entry.path) as files:
             has_download_instructions = any(
-                f.is_file() and f.name.startswith("download-instructions-") and f.name.endswith(".pdf")
-                for f in entry.iterdir()
+                f.name.startswith("download-instructions-") and f.name.endswith(".pdf") and f.is_file()
+                for f in files
             )
-            
-            if not has_download_instructions:
-                scaled = entry / 'scaled'
-                if scaled.is_dir():
-                    try:
-                        candidates.append((entry, scaled))
-                    except PermissionError:
-                        logging.warning(f"Skipping (no access): {scaled}")
+
+        if not has_download_instructions:
+            folder = Path(entry.path)
+            scaled = folder / 'scaled'
+            if scaled.is_dir():
+                try:
+                    candidates.append((folder, scaled))
+                except PermissionError:
+                    logging.warning(f"Skipping (no access): {scaled}")
     return candidates
 
 
@@ -285,31 +427,28 @@ def delete_all_files_in_folder(folder: Path) -> None:
     logging.info(f"Deleted {count} files in {folder}")
 
 
-def process_folder(service, parent_folder: Path, scaled_folder: Path, remove_scaled: bool = False) -> None:
+def process_folder(creds: Credentials, upload_executor: ThreadPoolExecutor, parent_folder: Path,
+                   scaled_folder: Path, drive_scaled_id: str, remove_scaled: bool = False) -> None:
     """
     Process one folder:
-      - Ensure /scaled/<FolderName>/ on Drive
-      - Upload all .zip files from scaled
+      - Ensure /scaled/<FolderName>/ on Drive (drive_scaled_id is the ID of /scaled)
+      - Upload all .zip files from scaled (concurrently on upload_executor)
       - Optionally delete all files from scaled (if remove_scaled=True)
       - Make Drive folder public, get link
       - Create PDF and upload it
     """
+    service = get_drive_service(creds)
     folder_name = parent_folder.name
     logging.info(f"=== Processing: {folder_name} ===")
 
     # Ensure Drive path: /scaled/<FolderName>/
-    drive_scaled_id = drive_ensure_folder(service, 'scaled', DRIVE_ROOT_PARENT_ID)
     drive_target_id = drive_ensure_folder(service, folder_name, drive_scaled_id)
 
     # Upload all .zip files
     zip_files = [p for p in scaled_folder.iterdir() if p.is_file() and p.suffix.lower() == '.zip']
     if zip_files:
         logging.info(f"Uploading {len(zip_files)} .zip file(s) to /scaled/{folder_name}/ …")
-        for z in zip_files:
-            try:
-                drive_upload_file(service, z, drive_target_id)
-            except HttpError as e:
-                logging.error(f"Drive upload failed for {z.name}: {e}")
+        drive_upload_files(upload_executor, creds, zip_files, drive_target_id)
     else:
         logging.info("No .zip files found to upload.")
 
@@ -321,19 +460,21 @@ def process_folder(service, parent_folder: Path, scaled_folder: Path, remove_sca
     link = drive_make_public_and_get_link(service, drive_target_id)
     logging.info(f"Share link: {link}")
 
-    # Create PDF locally
+    # Create PDF in memory and save the local copy (it also marks the folder as done)
     pdf_name = f"download-instructions-{folder_name}.pdf"
     pdf_path = parent_folder / pdf_name
     try:
-        create_pdf(pdf_path, link, folder_name)
+        pdf_bytes = create_pdf(link, folder_name)
+        pdf_path.write_bytes(pdf_bytes)
         logging.info(f"Created PDF: {pdf_path}")
     except Exception as e:
         logging.error(f"Failed to create PDF for {folder_name}: {e}")
         return
 
-    # Upload PDF to Drive folder
+    # Upload PDF to Drive folder straight from memory
     try:
-        drive_upload_file(service, pdf_path, drive_target_id)
+        drive_upload_with_retry(pdf_name, drive_upload_bytes, service, pdf_bytes, pdf_name,
+                                'application/pdf', drive_target_id)
         logging.info(f"Uploaded PDF to Drive: /scaled/{folder_name}/{pdf_name}")
     except HttpError as e:
         logging.error(f"Drive upload failed for PDF {pdf_name}: {e}")
@@ -351,7 +492,7 @@ def main() -> int:
         logging.info("Will remove files from scaled folders after upload")
 
     try:
-        service = get_drive_service()
+        creds = get_drive_credentials()
     except Exception as e:
         logging.error(f"Auth/Drive setup failed: {e}")
         return 1
@@ -361,11 +502,20 @@ def main() -> int:
         logging.info("No folders without download-instructions PDF files were found. Nothing to do.")
         return 0
 
-    for parent, scaled in candidates:
-        try:
-            process_folder(service, parent, scaled, args.remove_scaled)
-        except Exception as e:
-            logging.error(f"Unexpected error processing {parent.name}: {e}")
+    try:
+        drive_scaled_id = drive_ensure_folder(get_drive_service(creds), 'scaled', DRIVE_ROOT_PARENT_ID)
+    except Exception as e:
+        logging.error(f"Failed to ensure /scaled folder on Drive: {e}")
+        return 1
+
+    # One upload pool for the whole run, so worker threads keep their Drive
+    # services and connections across folders
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as upload_executor:
+        for parent, scaled in candidates:
+            try:
+                process_folder(creds, upload_executor, parent, scaled, drive_scaled_id, args.remove_scaled)
+            except Exception as e:
+                logging.error(f"Unexpected error processing {parent.name}: {e}")
 
     logging.info("All done.")
     return 0
@@ -1,7 +1,14 @@
+import io
 import os
 import zipfile
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
-from math import ceil
+
+try:
+    # Optional: libvips resizes and encodes faster than Pillow
+    import pyvips
+except (ImportError, OSError):
+    pyvips = None
 
 BASE_DIR = "."
 # Configuration
@@ -12,41 +19,162 @@ SCALES = {
     "24x36": (1728, 2592),
     "50x70": (1890, 2646), 
 }
+# Source image file extensions (lowercase)
+IMAGE_EXTENSIONS = {".png", ".webp", ".jpg", ".jpeg"}
+# Archive entries that are already compressed and are stored without deflate
+PRECOMPRESSED_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+# Archives are split so that each stays within this size (a larger single image gets its own)
+MAX_ARCHIVE_SIZE = 20 * 1024 * 1024
+# ZIP header bytes: local + central directory header per entry (plus the name
+# in each), and the end-of-central-directory record per archive
+ZIP_ENTRY_OVERHEAD = 30 + 46
+ZIP_ARCHIVE_OVERHEAD = 22
+# zlib level for PNG output: PNG is lossless, so this only trades file size for encode speed
+PNG_COMPRESS_LEVEL = 1
+# libvips PNG options; at level 1 its output is far larger than Pillow's, while
+# level 2 with adaptive filtering comes out about the same size as Pillow at level 1
+VIPS_PNG_OPTIONS = {"compression": 2, "filter": "all", "strip": True}
 
-def scale_and_crop(image_path, size):
-    with Image.open(image_path) as img:
-        # Convert to RGB mode to ensure consistent color handling
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-            
-        # Check if image is horizontal and rotate if needed
-        should_rotate = img.width > img.height
-        if should_rotate:
-            img = img.rotate(90, expand=True, resample=Image.BICUBIC)
+def prepare_image(img):
+    # Convert to RGB mode to ensure consistent color handling
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
         
-        aspect_ratio = img.width / img.height
-        target_width, target_height = size
-        target_aspect_ratio = target_width / target_height
+    # Check if image is horizontal and rotate if needed
+    should_rotate = img.width > img.height
+    if should_rotate:
+        img = img.rotate(90, expand=True, resample=Image.BICUBIC)
+    return img
+
+def cover_box(width, height, size):
+    # Returns the size to resize a width x height image to so that it covers
+    # `size`, and the top-left offset of the centred crop
+    target_width, target_height = size
+
+    # Exact integer math: compare aspect ratios by cross-multiplying, round sizes up
+    if width * target_height > height * target_width:  # Image is wider
+        new_height = target_height
+        new_width = (new_height * width + height - 1) // height
+    else:  # Image is taller or equal aspect ratio
+        new_width = target_width
+        new_height = (new_width * height + width - 1) // width
+
+    left = (new_width - target_width) // 2
+    top = (new_height - target_height) // 2
+    return new_width, new_height, left, top
+
+def _scale_from_decoded(img, size):
+    # img must already be prepared with prepare_image(); it is not modified
+    target_width, target_height = size
+    new_width, new_height, left, top = cover_box(img.width, img.height, size)
+
+    # Box-reduce by an integer factor first while staying >= 2x the target,
+    # so the final LANCZOS pass works on a much smaller image
+    factor = min(img.width // (new_width * 2), img.height // (new_height * 2))
+    if factor > 1:
+        img = img.reduce(factor)
+    img = img.resize((new_width, new_height), Image.LANCZOS)
+    right = left + target_width
+    bottom = top + target_height
+
+    return img.crop((left, top, right, bottom))
+
+def encode_png(image):
+    buf = io.BytesIO()
+    # Save with maximum quality settings
+    image.save(buf, format="PNG", optimize=False, compress_level=PNG_COMPRESS_LEVEL)
+    return buf.getvalue()
+
+def vips_prepare_image(image_path):
+    # libvips counterpart of prepare_image(); decodes the file into memory once
+    img = pyvips.Image.new_from_file(image_path)
+    if img.interpretation != "srgb":
+        img = img.colourspace("srgb")
+    if img.bands > 3:
+        img = img.extract_band(0, n=3)
+    if img.width > img.height:
+        img = img.rot270()  # counter-clockwise, like PIL's rotate(90)
+    return img.copy_memory()
 
-        if aspect_ratio > target_aspect_ratio:  # Image is wider
-            new_height = target_height
-            new_width = ceil(new_height * aspect_ratio)
-        else:  # Image is taller or equal aspect ratio
-            new_width = target_width
-            new_height = ceil(new_width / aspect_ratio)
+def vips_scale_and_crop_png(img, size):
+    # libvips counterpart of encode_png(_scale_from_decoded(...)): same geometry,
+    # pixels within a few levels of the PIL output, comparable PNG size
+    target_width, target_height = size
+    new_width, new_height, left, top = cover_box(img.width, img.height, size)
+    hscale = new_width / img.width
+    vscale = new_height / img.height
+    if hscale <= 1 and vscale <= 1:
+        img = img.resize(hscale, vscale=vscale, kernel="lanczos3")
+    else:
+        # resize() upsamples with corner-aligned pixels, shifting the image;
+        # use an affine with centre-aligned offsets like PIL instead
+        img = img.affine(
+            [hscale, 0, 0, vscale],
+            interpolate=pyvips.Interpolate.new("bicubic"),
+            odx=(hscale - 1) / 2, ody=(vscale - 1) / 2,
+            oarea=[0, 0, new_width, new_height],
+        )
+    img = img.crop(left, top, target_width, target_height)
+    return img.write_to_buffer(".png", **VIPS_PNG_OPTIONS)
 
-        img = img.resize((new_width, new_height), Image.LANCZOS)
-        left = (new_width - target_width) / 2
-        top = (new_height - target_height) / 2
-        right = left + target_width
-        bottom = top + target_height
+def _init_worker():
+    # Each pool process already owns a core; keep libvips single-threaded
+    # and without an operation cache so workers do not oversubscribe the CPU
+    if pyvips is not None:
+        pyvips.concurrency_set(1)
+        pyvips.cache_set_max(0)
 
-        return img.crop((left, top, right, bottom))
+def write_file(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return len(data)
+
+def _scale_image(image_path, out_paths):
+    # Runs in a worker process: decodes the image once, writes the encoded PNG
+    # for every scale to out_paths[scale_name] and returns the sizes written
+    if pyvips is not None:
+        img = vips_prepare_image(image_path)
+        return {
+            scale_name: write_file(out_paths[scale_name], vips_scale_and_crop_png(img, size))
+            for scale_name, size in SCALES.items()
+        }
+    with Image.open(image_path) as img:
+        img = prepare_image(img)
+        return {
+            scale_name: write_file(out_paths[scale_name], encode_png(_scale_from_decoded(img, size)))
+            for scale_name, size in SCALES.items()
+        }
+
+def pack_archives(sizes, arcnames, max_size=MAX_ARCHIVE_SIZE):
+    # First-fit decreasing: place each file, largest first, into the first
+    # archive that still has room (ZIP headers included), else start a new
+    # archive. Returns one list of file indices per archive, in image order.
+    entry_sizes = [
+        size + ZIP_ENTRY_OVERHEAD + 2 * len(arcname.encode("utf-8"))
+        for size, arcname in zip(sizes, arcnames)
+    ]
+    max_size -= ZIP_ARCHIVE_OVERHEAD
+    archives = []
+    totals = []
+    for idx in sorted(range(len(entry_sizes)), key=entry_sizes.__getitem__, reverse=True):
+        size = entry_sizes[idx]
+        for i, total in enumerate(totals):
+            if total + size <= max_size:
+                archives[i].append(idx)
+                totals[i] += size
+                break
+        else:
+            archives.append([idx])
+            totals.append(size)
+    return sorted(sorted(indices) for indices in archives)
 
 def create_zip(archive_path, files):
     with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
         for file_path, arcname in files:
-            zipf.write(file_path, arcname)
+            if arcname.lower().endswith(PRECOMPRESSED_EXTENSIONS):
+                zipf.write(file_path, arcname, compress_type=zipfile.ZIP_STORED)
+            else:
+                zipf.write(file_path, arcname)
 
 def process_folder(folder_path):
     print(f"Processing folder: {folder_path}")
@@ -54,42 +182,57 @@ def process_folder(folder_path):
     scaled_dir = os.path.join(folder_path, "scaled")
     os.makedirs(scaled_dir, exist_ok=True)
 
-    image_paths = [
-        os.path.join(folder_path, f)
-        for f in os.listdir(folder_path)
-        if f.lower().endswith((".png", ".webp", ".jpg", ".jpeg"))
-    ]
+    with os.scandir(folder_path) as entries:
+        image_paths = [
+            entry.path
+            for entry in entries
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS
+        ]
 
-    for scale_name, size in SCALES.items():
-        scaled_images = []
-
-        for idx, image_path in enumerate(image_paths, start=1):
-            scaled_image_path = os.path.join(
-                scaled_dir, f"{idx}_{folder_name}_{scale_name}.png"
-            )
-            scaled_image = scale_and_crop(image_path, size)
-            # Save with maximum quality settings
-            scaled_image.save(scaled_image_path, format="PNG", optimize=False)
-            scaled_images.append(scaled_image_path)
-
-        archive_base_name = os.path.join(scaled_dir, f"{folder_name}_{scale_name}")
-        current_files = []
-        for scaled_image_path in scaled_images:
-            arcname = os.path.basename(scaled_image_path)
-            current_files.append((scaled_image_path, arcname))
+    # Every image is decoded once and produces all scales. Workers write the
+    # encoded PNGs to "scaled" (where they are kept next to the archives) and
+    # only return their sizes, so memory stays bounded while all sizes are
+    # collected for packing
+    out_paths = [
+        {
+            scale_name: os.path.join(scaled_dir, f"{idx}_{folder_name}_{scale_name}.png")
+            for scale_name in SCALES
+        }
+        for idx in range(1, len(image_paths) + 1)
+    ]
+    # Per scale: parallel lists of file paths, archive names and file sizes
+    paths = {scale_name: [] for scale_name in SCALES}
+    arcnames = {scale_name: [] for scale_name in SCALES}
+    sizes = {scale_name: [] for scale_name in SCALES}
+    # Scaling is CPU-bound and independent per image; use one process per core
+    with ProcessPoolExecutor(initializer=_init_worker) as executor:
+        results = executor.map(_scale_image, image_paths, out_paths)
+        for image_out_paths, image_sizes in zip(out_paths, results):
+            for scale_name, size in image_sizes.items():
+                path = image_out_paths[scale_name]
+                paths[scale_name].append(path)
+                arcnames[scale_name].append(os.path.basename(path))
+                sizes[scale_name].append(size)
 
-        archive_path = f"{archive_base_name}.zip"
-        create_zip(archive_path, current_files)
+    for scale_name in SCALES:
+        scale_paths, scale_arcnames = paths[scale_name], arcnames[scale_name]
+        for n, indices in enumerate(pack_archives(sizes[scale_name], scale_arcnames), start=1):
+            suffix = "" if n == 1 else f"_{n}"
+            archive_path = os.path.join(scaled_dir, f"{folder_name}_{scale_name}{suffix}.zip")
+            create_zip(archive_path, [(scale_paths[i], scale_arcnames[i]) for i in indices])
 
 if __name__ == "__main__":
     images_dir = os.path.expanduser(BASE_DIR)
 
-    for folder in os.listdir(images_dir):
-        folder_path = os.path.join(images_dir, folder)
+    with os.scandir(images_dir) as entries:
         # Skip venv folder and folders that already have 'scaled'
-        if (
-            os.path.isdir(folder_path)
-            and folder != "venv"
-            and "scaled" not in os.listdir(folder_path)
-        ):
-            process_folder(folder_path)
+        folders = [
+            entry.path
+            for entry in entries
+            if entry.is_dir()
+            and entry.name != "venv"
+            and not os.path.exists(os.path.join(entry.path, "scaled"))
+        ]
+
+    for folder_path in folders:
+        process_folder(folder_path)